@@ -9,3 +9,7 @@ from sloppy.transport import TCPServer
 from sloppy.flow import Protocol
 from sloppy.flow import ServerFactory
 from sloppy.flow import ConnectionFactory
+from sloppy.flow import ReconnectingClientFactory
+from sloppy.resolver import Resolver
+from sloppy.loopback import LoopbackTransport
+from sloppy.loopback import SimulatedApplication
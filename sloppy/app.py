@@ -2,6 +2,8 @@
     Main application loop code in here bitches.
 '''
 
+import time
+import heapq
 import socket
 import select
 import errno
@@ -18,11 +20,28 @@ class Application(object):
     cqueue = [] # [ [ address, port, factory ] ]
     conn = []
     
+    # Admission limits for every server in the application. See ServerFactory.
+    # max_connections counts connections accepted by all servers together.
+    # These apply on top of each server's own limits.
+    max_connections = None
+    max_lag = None
+    max_outbound = None
+    
     def __init__(self, *args, **kwargs):
         self.running = False
         self.cqueue = []
         self.conn = []
         self.cobj = []
+        self.timers = [] # [ [ when, sequence, callback, args ] ]
+        self._tseq = 0
+        self.servers = []
+        self.sockets = {} # { socket: [ transport, protocol, fileno, events ] }
+        self.fds = {} # { fileno: socket }
+        self.writers = set() # Transports with buffered data.
+        self.connects = {} # { socket: [ transport, fileno, timer ] }
+        self.poller = select.poll() if hasattr(select, 'poll') else None
+        self.lag = 0
+        self.outbound = 0
         self.init(*args, **kwargs)
     
     def init(self, *args, **kwargs):
@@ -43,24 +62,281 @@ class Application(object):
     def open(self, transport):
         """
         Open a connection on a transport.
+        
+        If the connection is still being established, it is only added to the
+        loop once it is open.
         """
         if not transport.connect():
             return
         
+        if transport.connecting:
+            self.await_connect(transport)
+            return
+        
+        self.established(transport)
+    
+    def established(self, transport):
+        """
+        Add a transport with an open connection to the loop.
+        """
+        if getattr(transport, 'listening', False):
+            self.servers.append(transport)
+        
         protocol = transport.protocol()
-        self.conn.append([ transport, protocol ])
-        self.cobj.append(transport.conn)
+        self.watch(transport, protocol)
         protocol.connected(transport)
     
     def accept(self, transport):
         """
         Accept and serve a socket connection.
+        
+        If the server rejects connections when overloaded, and it is, the
+        connection is closed straight away. Servers which pause instead are
+        taken out of the read set at the end of the iteration.
         """
+        server = transport.server
+        
+        if server is not None:
+            reason = None
+            
+            if getattr(server.factory, 'overload', 'pause') == 'reject':
+                reason = self.overloaded(server)
+            
+            if reason is not None:
+                transport.server = None
+                transport.close(reason)
+                transport.closed(reason)
+                return
+            
+            server.connections += 1
+        
         protocol = transport.protocol()
-        self.conn.append([ transport, protocol ])
-        self.cobj.append(transport.conn)
+        self.watch(transport, protocol)
         protocol.connected( transport )
     
+    def await_connect(self, transport):
+        """
+        Wait for a transport's socket to finish connecting.
+        
+        The socket becomes writable once the connection is open or has
+        failed. If that takes longer than the factory's `connect_timeout`,
+        the transport gives up on the address.
+        """
+        sock = transport.conn
+        fd = None
+        timer = None
+        
+        if self.poller is not None:
+            fd = sock.fileno()
+            self.fds[fd] = sock
+            self.poller.register(fd, select.POLLOUT)
+        
+        timeout = getattr(transport.factory, 'connect_timeout', None)
+        
+        if timeout is not None:
+            timer = self.call_later(timeout, self.finish_connect, sock, True)
+        
+        self.connects[sock] = [ transport, fd, timer ]
+    
+    def finish_connect(self, sock, timed_out=False):
+        """
+        Handle a socket which finished connecting, or took too long to.
+        """
+        entry = self.connects.pop(sock, None)
+        
+        if entry is None:
+            return
+        
+        transport, fd, timer = entry
+        self.unregister(sock, fd)
+        
+        if timer is not None:
+            self.cancel(timer)
+        
+        if transport.conn is not sock:
+            # Closed while it was connecting.
+            return
+        
+        if timed_out:
+            result = transport.abandon(socket.timeout('Connection timed out'))
+        else:
+            result = transport.check_connect()
+        
+        if not result:
+            return
+        
+        if transport.connecting:
+            # Trying the next address.
+            self.await_connect(transport)
+            return
+        
+        self.established(transport)
+    
+    def watch(self, transport, protocol):
+        """
+        Add a connection to the loop, and register its socket with the poller.
+        """
+        sock = transport.conn
+        fd = None
+        events = None
+        
+        if self.poller is not None and hasattr(sock, 'fileno'):
+            fd = sock.fileno()
+            events = select.POLLIN | select.POLLPRI
+            self.fds[fd] = sock
+            self.poller.register(fd, events)
+        
+        conn = [ transport, protocol, fd, events ]
+        self.conn.append(conn)
+        self.cobj.append(sock)
+        self.sockets[sock] = conn
+        transport.loop = self
+        
+        # Anything written while connecting still has to go out.
+        if transport.buffered():
+            self.writers.add(transport)
+    
+    def unwatch(self, sock):
+        """
+        Forget about a socket which has been removed from the loop.
+        """
+        conn = self.sockets.pop(sock, None)
+        
+        if conn is None:
+            return
+        
+        self.writers.discard(conn[0])
+        self.unregister(sock, conn[2])
+    
+    def unregister(self, sock, fd):
+        """
+        Stop polling a socket's descriptor.
+        """
+        # The descriptor may already belong to a newer socket.
+        if fd is not None and self.fds.get(fd) is sock:
+            del self.fds[fd]
+            self.poller.unregister(fd)
+    
+    def interest(self, transport):
+        """
+        Update the events the poller waits for on a transport's socket.
+        
+        Paused transports are not read from, and only blocked transports are
+        waited on for writing.
+        """
+        conn = self.sockets.get(transport.conn, None)
+        
+        if conn is None or conn[2] is None:
+            return
+        
+        events = 0 if transport.paused else select.POLLIN | select.POLLPRI
+        
+        if transport.blocked:
+            events |= select.POLLOUT
+        
+        if events != conn[3]:
+            conn[3] = events
+            self.poller.modify(conn[2], events)
+    
+    def writing(self, transport):
+        """
+        Called by transports when they start buffering data, so the next
+        flush knows to send it.
+        """
+        self.writers.add(transport)
+    
+    def overloaded(self, server):
+        """
+        Check if `server` should stop admitting connections.
+        
+        Returns a reason if it should, or `None` if it shouldn't.
+        """
+        factory = server.factory
+        
+        if self.max_connections is not None:
+            if sum(s.connections for s in self.servers) >= self.max_connections:
+                return 'Too many connections'
+        
+        limit = getattr(factory, 'max_connections', None)
+        if limit is not None and server.connections >= limit:
+            return 'Too many connections on server'
+        
+        for limit in (getattr(factory, 'max_lag', None), self.max_lag):
+            if limit is not None and self.lag > limit:
+                return 'Application loop lagging'
+        
+        for limit in (getattr(factory, 'max_outbound', None), self.max_outbound):
+            if limit is not None and self.outbound > limit:
+                return 'Too much outbound data'
+        
+        if hasattr(factory, 'admit') and not factory.admit(server, self):
+            return 'Refused by factory'
+        
+        return None
+    
+    def admission(self):
+        """
+        Pause servers which are overloaded, and resume those which aren't.
+        
+        Servers set to reject connections when overloaded are only paused
+        when they have run out of resources to accept with.
+        """
+        self.servers = [s for s in self.servers if s.conn is not None]
+        
+        for server in self.servers:
+            if getattr(server, 'exhausted', False):
+                server.paused = True
+                continue
+            
+            if getattr(server.factory, 'overload', 'pause') != 'pause':
+                server.paused = False
+                continue
+            
+            server.paused = self.overloaded(server) is not None
+    
+    def now(self):
+        """
+        Return the current time according to the application loop.
+        """
+        return time.time()
+    
+    def call_later(self, delay, callback, *args):
+        """
+        Call `callback` with `args` after `delay` seconds.
+        
+        Returns a timer object which can be given to `cancel`.
+        """
+        self._tseq += 1
+        timer = [ self.now() + delay, self._tseq, callback, args ]
+        heapq.heappush(self.timers, timer)
+        return timer
+    
+    def cancel(self, timer):
+        """
+        Cancel a timer created with `call_later`.
+        """
+        timer[2] = None
+    
+    def run_timers(self):
+        """
+        Call any timers which are due.
+        """
+        now = self.now()
+        
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)
+            if timer[2] is not None:
+                timer[2](*timer[3])
+    
+    def timeout(self):
+        """
+        Return how long the loop can wait for socket events.
+        """
+        if not self.timers:
+            return .5
+        
+        return min(.5, max(0, self.timers[0][0] - self.now()))
+    
     def start_connections(self):
         """
         Start any connections in the queue.
@@ -81,6 +357,7 @@ class Application(object):
             
             if conn[0].conn is None:
                 dcr = conn[0].dcreason
+                self.unwatch(cobj)
                 conn[1].connection_closed(dcr)
                 conn[0].closed(dcr)
                 continue
@@ -91,6 +368,36 @@ class Application(object):
         self.cobj = ncobj
         self.conn = nconn
     
+    def flush_connections(self, writable=()):
+        """
+        Send any data buffered on our connections.
+        
+        This is called at the end of every iteration of the main loop, so all
+        writes queued while dispatching go out in a single flush. Connections
+        which are blocked are only flushed once their socket is in
+        `writable`.
+        """
+        outbound = 0
+        writable = set(writable)
+        
+        for transport in list(self.writers):
+            if transport.conn is None:
+                self.writers.discard(transport)
+                continue
+            
+            if transport.pending() and (not transport.blocked
+                or transport.conn in writable):
+                    transport.flush()
+            
+            self.interest(transport)
+            
+            size = transport.buffered()
+            if size == 0:
+                self.writers.discard(transport)
+            outbound += size
+        
+        self.outbound = outbound
+    
     def start(self):
         """
         Start the application.
@@ -99,6 +406,40 @@ class Application(object):
         self.clean_connections()
         self.main_loop()
     
+    def wait(self, rlist, wlist, timeout):
+        """
+        Wait for sockets to become readable or writable.
+        
+        Uses `poll` where it is available, as `select` can't handle more than
+        a few thousand sockets. Every socket in the loop is registered with
+        the poller, so `rlist` and `wlist` are only used when falling back to
+        `select`. Paused servers are not waited on for reading. Returns lists
+        like `select.select` does.
+        """
+        if self.poller is None:
+            paused = [s.conn for s in self.servers if s.paused]
+            if paused:
+                rlist = [s for s in rlist if s not in paused]
+            return select.select(rlist, wlist, rlist, timeout)
+        
+        for server in self.servers:
+            self.interest(server)
+        
+        read, write, err = [], [], []
+        
+        for fd, event in self.poller.poll(timeout * 1000):
+            s = self.fds.get(fd, None)
+            if s is None:
+                continue
+            if event & (select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR):
+                read.append(s)
+            if event & select.POLLOUT:
+                write.append(s)
+            if event & (select.POLLERR | select.POLLNVAL):
+                err.append(s)
+        
+        return read, write, err
+    
     def main_loop(self):
         """
         Main application loop.
@@ -106,18 +447,33 @@ class Application(object):
         self.running = True
         
         while self.running:
-            read, write, err = select.select(self.cobj, [], self.cobj, .5)
+            # Wait on sockets that couldn't take all of their data.
+            wobj = [t.conn for t in self.writers
+                if t.blocked and t.conn is not None]
+            # And on sockets which are still connecting.
+            wobj.extend(self.connects)
+            read, write, err = self.wait(self.cobj, wobj, self.timeout())
+            woken = self.now()
+            
+            if self.connects:
+                for s in write + err:
+                    if s in self.connects:
+                        self.finish_connect(s)
             
             for s in read:
-                index = self.cobj.index( s )
-                conn = self.conn[index]
+                conn = self.sockets.get(s, None)
+                
+                if conn is None or conn[0].conn is None:
+                    # Closed while handling another socket. Cleaned up later.
+                    continue
+                
                 data = conn[0].read(8192)
                 
                 if data is None:
                     # Nothing to do at the moment. Ignore everything I guess.
                     continue
                 
-                if isinstance(data, str):
+                if isinstance(data, bytes):
                     # Received some raw data on a connection.
                     try:
                         conn[1].on_data(data)
@@ -136,11 +492,17 @@ class Application(object):
                 # our pool.
                 conn[0].close(data)
                 conn[1].connection_closed(data)
+                index = self.cobj.index( s )
                 self.cobj.pop(index)
                 self.conn.pop(index)
+                self.unwatch(s)
                 conn[0].closed(data)
             
+            self.run_timers()
+            self.flush_connections(write)
             self.clean_connections()
+            self.lag = self.now() - woken
+            self.admission()
         
         # Cleanup!
     
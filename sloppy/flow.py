@@ -1,13 +1,39 @@
 ''' sloppy.flow - photofroggy
     Base classes for controlling program flow.
 '''
+import random
 
 
 class ConnectionFactory(object):
     """
     Base interface for any connection factories.
+    
+    The attributes below are used to tune the sockets of transports created
+    with this factory. Options left as `None` are not touched, so the
+    operating system defaults apply. Set them on a subclass or an instance to
+    tune latency-sensitive and bulk connections separately.
+    
+    Client transports resolve host names using `resolver`, or a shared
+    resolver if this is `None`. Each address is given `connect_timeout`
+    seconds to accept the connection before the next one is tried.
+    
+    If `coalesce` is `True`, writes made on a transport are buffered and sent
+    in a single flush at the end of each iteration of the application loop.
+    
+    If `cork` is `True`, corking a transport sets TCP_CORK on its socket, so
+    the kernel holds back partial segments rather than the transport
+    buffering the writes itself.
     """
     
+    resolver = None # sloppy.resolver.Resolver
+    connect_timeout = 5.0
+    nodelay = None  # TCP_NODELAY
+    cork = None     # TCP_CORK (Linux only)
+    quickack = None # TCP_QUICKACK (Linux only)
+    sndbuf = None   # SO_SNDBUF
+    rcvbuf = None   # SO_RCVBUF
+    coalesce = False
+    
     def starting(self):
         """
         We have started to connect, or are just about to. I dunno.
@@ -35,11 +61,144 @@ class ConnectionFactory(object):
         """
 
 
+class ReconnectingClientFactory(ConnectionFactory):
+    """
+    A client factory which reconnects when the connection fails or is lost.
+    
+    Reconnection attempts are scheduled on the application loop, with the
+    delay growing exponentially from `initial_delay` up to `max_delay`. Each
+    delay is randomly adjusted by up to `jitter` times itself, so that many
+    clients don't all retry at the same moment. If `max_retries` is not
+    `None`, the factory gives up after that many failed attempts in a row.
+    """
+    
+    initial_delay = 1.0
+    max_delay = 60.0
+    factor = 2.0
+    jitter = 0.1
+    max_retries = None
+    
+    def __init__(self, app, protocol=None, *args, **kwargs):
+        """
+        Store the application and the protocol class used for connections.
+        """
+        self.app = app
+        self._protocol = protocol or Protocol
+        self.retries = 0
+        self.delay = self.initial_delay
+        self.trying = True
+        self._timer = None
+        self.init(*args, **kwargs)
+    
+    def init(self, *args, **kwargs):
+        """
+        Child classes should override this to do stuff on instances.
+        """
+    
+    def protocol(self):
+        """
+        Return appropriate protocol object.
+        """
+        return self._protocol()
+    
+    def connected(self, transport):
+        """
+        Connection opened! Reset the delay for the next time we lose it.
+        """
+        self.reset_delay()
+    
+    def fail(self, transport, reason):
+        """
+        Connection failed. Try again later.
+        """
+        self.retry(transport)
+    
+    def closed(self, transport, reason):
+        """
+        We have lost our connection. Try to get it back.
+        """
+        self.retry(transport)
+    
+    def reset_delay(self):
+        """
+        Reset the retry count and delay.
+        """
+        self.retries = 0
+        self.delay = self.initial_delay
+    
+    def next_delay(self):
+        """
+        Return the delay before the next attempt, and back off.
+        """
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.max_delay)
+        delay += random.uniform(-self.jitter, self.jitter) * delay
+        return max(0, min(delay, self.max_delay))
+    
+    def retry(self, transport):
+        """
+        Schedule another connection attempt on the application loop.
+        """
+        if not self.trying:
+            return
+        
+        self.retries += 1
+        
+        if self.max_retries is not None and self.retries > self.max_retries:
+            self.give_up(transport)
+            return
+        
+        self._timer = self.app.call_later(self.next_delay(), self.reconnect,
+            transport)
+    
+    def reconnect(self, transport):
+        """
+        Try to connect again.
+        """
+        self._timer = None
+        self.app.connect(transport)
+    
+    def stop_trying(self):
+        """
+        Stop reconnecting, cancelling any attempt which is scheduled.
+        """
+        self.trying = False
+        
+        if self._timer is not None:
+            self.app.cancel(self._timer)
+            self._timer = None
+    
+    def give_up(self, transport):
+        """
+        Called when `max_retries` attempts have failed in a row.
+        """
+
+
 class ServerFactory(ConnectionFactory):
     """
     A basic factory that serves connections on a port.
+    
+    The attributes below control when the server stops admitting new
+    connections. Limits left as `None` are not checked. `max_lag` is in
+    seconds spent handling one iteration of the application loop, and
+    `max_outbound` is in bytes waiting to be sent across all connections.
+    
+    When the server is overloaded, `overload` decides what happens. With
+    'pause', the server stops accepting until the load drops, leaving new
+    connections in the listen backlog. With 'reject', new connections are
+    accepted and closed straight away.
+    
+    If the server runs out of descriptors or memory while accepting, it is
+    paused whatever `overload` says, and tries again once a connection is
+    released or after `retry_accept` seconds.
     """
     
+    max_connections = None
+    max_lag = None
+    max_outbound = None
+    overload = 'pause'
+    retry_accept = 1.0
+    
     def __init__(self, protocol=None, *args, **kwargs):
         """
         Store the protocol class to be used for connections.
@@ -57,6 +216,15 @@ class ServerFactory(ConnectionFactory):
         Return appropriate protocol object.
         """
         return self._protocol()
+    
+    def admit(self, server, app):
+        """
+        Return `False` to stop admitting new connections on `server`.
+        
+        Child classes can override this to base admission on their own
+        metrics, or on `app.lag` and `app.outbound`.
+        """
+        return True
 
 
 class Protocol(object):
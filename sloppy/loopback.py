@@ -0,0 +1,191 @@
+''' sloppy.loopback - photofroggy
+    In-memory transports and a simulated application loop.
+    
+    These let protocols be driven without sockets, so parsing and dispatch
+    can be measured on their own. For example:
+        
+        app = SimulatedApplication()
+        transport = LoopbackTransport('loopback', 0, factory)
+        app.connect(transport)
+        transport.feed(recording, chunk=512)
+        app.start()
+    
+    The application stops once there is no more input and no timers are due.
+'''
+from collections import deque
+
+from sloppy.app import Application
+from sloppy.transport import Transport
+
+
+class LoopbackTransport(Transport):
+    """
+    Transport which keeps data in memory instead of using a socket.
+    
+    Data given to `feed` is read back in the same chunks, so the sizes of the
+    chunks passed to the protocol can be controlled. Data written is stored
+    in `written` if `capture` is `True`, and is passed on to the `peer`
+    transport if there is one.
+    """
+    
+    def init(self, addr, port, factory=None, capture=True):
+        """
+        Set up the buffers.
+        """
+        self.peer = None
+        self.capture = capture
+        self.inbox = deque()
+        self.written = []
+        self.eof = False
+    
+    def connect(self):
+        """
+        Open the connection. This never fails.
+        """
+        self.factory.starting()
+        self.conn = self
+        self.dcreason = None
+        self.factory.connected(self)
+        return True
+    
+    def feed(self, data, chunk=None):
+        """
+        Queue `data` to be read from the transport, split into `chunk` sized
+        pieces if `chunk` is given.
+        """
+        if not chunk:
+            self.inbox.append(data)
+            return
+        
+        for i in range(0, len(data), chunk):
+            self.inbox.append(data[i:i + chunk])
+    
+    def end(self):
+        """
+        Act as though the remote end closed the connection once everything
+        queued has been read.
+        """
+        self.eof = True
+    
+    def readable(self):
+        """
+        Return `True` if reading from the transport would return something.
+        """
+        return self.conn is not None and (len(self.inbox) > 0 or self.eof)
+    
+    def read(self, bytes=0):
+        """
+        Read the next chunk of data queued on the transport.
+        
+        Returns `None` if nothing is queued, and `False` if the connection
+        has been ended.
+        """
+        if self.inbox:
+            data = self.inbox.popleft()
+            if bytes and len(data) > bytes:
+                self.inbox.appendleft(data[bytes:])
+                data = data[:bytes]
+            return data
+        
+        if self.eof:
+            return False
+        
+        return None
+    
+    def send(self, data):
+        """
+        Record the data and pass it on to our peer.
+        """
+        if self.capture:
+            self.written.append(data)
+        
+        if self.peer is not None and self.peer.conn is not None:
+            self.peer.inbox.append(data)
+        
+        return len(data)
+    
+    def output(self):
+        """
+        Return everything written to the transport so far, and forget it.
+        """
+        data = b''.join(self.written)
+        self.written = []
+        return data
+    
+    def close(self, reason=None):
+        """
+        Close the connection, ending our peer's side too.
+        """
+        self.corked = False
+        self.flush()
+        self.conn = None
+        self.dcreason = reason
+        
+        if self.peer is not None:
+            self.peer.eof = True
+
+
+def pair(factory=None, peer_factory=None, capture=True):
+    """
+    Return two loopback transports connected to each other.
+    """
+    one = LoopbackTransport('loopback', 0, factory, capture)
+    two = LoopbackTransport('loopback', 0, peer_factory, capture)
+    one.peer = two
+    two.peer = one
+    return one, two
+
+
+class SimulatedApplication(Application):
+    """
+    Application loop for loopback transports, driven by a simulated clock.
+    
+    The clock only moves when `advance` is called, or when the loop has
+    nothing else to do and skips ahead to the next timer. Nothing ever
+    sleeps, so runs are fast and repeatable.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        self.clock = 0.0
+        Application.__init__(self, *args, **kwargs)
+    
+    def now(self):
+        """
+        Return the simulated time.
+        """
+        return self.clock
+    
+    def advance(self, seconds):
+        """
+        Move the clock forward and call any timers which are due.
+        """
+        self.clock += seconds
+        self.run_timers()
+    
+    batch = 4096
+    
+    def wait(self, rlist, wlist, timeout):
+        """
+        Return the transports which have data to read.
+        
+        Each transport is listed once for every chunk queued on it, up to
+        `batch` times, so the loop reads those chunks back to back instead of
+        going round once per chunk. If there is nothing to read, the clock
+        skips to the next timer. If there are no timers either, the
+        application stops.
+        """
+        read = []
+        
+        for t in rlist:
+            if t.readable():
+                read.extend([t] * min(len(t.inbox) + t.eof, self.batch))
+        
+        if read:
+            return read, [], []
+        
+        if self.timers:
+            self.clock = max(self.clock, self.timers[0][0])
+        else:
+            self.stop()
+        
+        return [], [], []
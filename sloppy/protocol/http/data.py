@@ -6,7 +6,10 @@ try:
 except ImportError:
     from http.server import BaseHTTPRequestHandler
 
-from StringIO import StringIO
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 
 class Request(BaseHTTPRequestHandler):
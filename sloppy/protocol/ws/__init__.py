@@ -2,3 +2,9 @@
     Implements the WebSocket protocol.
 '''
 
+from sloppy.protocol.ws.flow import WebSocketServerFactory
+from sloppy.protocol.ws.flow import WebSocketServerProtocol
+from sloppy.protocol.ws.flow import WebSocketClientFactory
+from sloppy.protocol.ws.flow import WebSocketClientProtocol
+from sloppy.protocol.ws.transport import WebSocketServer
+from sloppy.protocol.ws.transport import WebSocketClient
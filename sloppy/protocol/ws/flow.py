@@ -5,6 +5,7 @@ from sloppy.flow import Protocol
 from sloppy.flow import ServerFactory
 from sloppy.flow import ConnectionFactory
 from sloppy.protocol import http
+from sloppy.protocol.ws import frame
 from sloppy.protocol.ws.error import WSHandshakeError
 
 
@@ -104,8 +105,155 @@ class WebSocketServerProtocol(Protocol):
         """
         Handshake received.
         """
-    
 
 
+class WebSocketClientFactory(ConnectionFactory):
+    """
+    WebSocket client factory.
+    
+    This factory creates protocol objects for connections opened with a
+    WebSocketClient transport.
+    """
+    
+    def __init__(self, protocol=None, *args, **kwargs):
+        """
+        Store the protocol class to be used for connections.
+        """
+        self._protocol = protocol or WebSocketClientProtocol
+        self.init(*args, **kwargs)
+    
+    def init(self, *args, **kwargs):
+        """
+        Child classes should override this to do stuff on instances.
+        """
+    
+    def protocol(self):
+        """
+        Return appropriate protocol object.
+        """
+        return self._protocol(self)
 
 
+class WebSocketClientProtocol(Protocol):
+    """
+    Base protocol object for WebSocket client connections.
+    
+    Handles the server's response to the upgrade request, then splits the
+    data received into messages. Child classes should override
+    `on_handshake` and `on_message`.
+    """
+    
+    def __init__(self, factory=None):
+        self._buffer = b''
+        self._message = []
+        self._binary = False
+        self._factory = factory
+        self._transport = None
+    
+    def connected(self, transport):
+        """
+        Connected to the server. The upgrade request has already been sent.
+        
+        Store the transport.
+        """
+        self._transport = transport
+    
+    def on_data(self, data):
+        """
+        Called when data is received on the connection.
+        """
+        self._buffer += data
+        
+        if not self._transport.handshaked:
+            end = self._buffer.find(b'\r\n\r\n')
+            
+            if end < 0:
+                return
+            
+            response = self._buffer[:end].decode('latin-1')
+            self._buffer = self._buffer[end + 4:]
+            self.check_handshake(response)
+            self._transport.handshaked = True
+            self.on_handshake()
+        
+        offset = 0
+        
+        while self._transport.conn is not None:
+            result = frame.decode(self._buffer, offset)
+            
+            if result is None:
+                break
+            
+            fin, opcode, payload, offset = result
+            self.on_frame(fin, opcode, payload)
+        
+        self._buffer = self._buffer[offset:]
+    
+    def check_handshake(self, response):
+        """
+        Make sure the server accepted the upgrade request.
+        
+        Raises a WSHandshakeError if it didn't.
+        """
+        lines = response.split('\r\n')
+        status = lines[0].split(' ', 2)
+        headers = {}
+        
+        for line in lines[1:]:
+            if ':' not in line:
+                continue
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        
+        # Needs to be switching protocols.
+        if len(status) < 2 or status[1] != '101':
+            raise WSHandshakeError('Server refused to upgrade the connection')
+        # Needs to be switching to WebSocket.
+        if 'websocket' not in headers.get('upgrade', '').lower():
+            raise WSHandshakeError('Invalid Upgrade header')
+        # Needs to be upgrading the connection.
+        if 'upgrade' not in headers.get('connection', '').lower():
+            raise WSHandshakeError('Invalid Connection header')
+        # Needs to have accepted our key.
+        if not self._transport.verify(headers.get('sec-websocket-accept', None)):
+            raise WSHandshakeError('Invalid Sec-WebSocket-Accept header')
+    
+    def on_frame(self, fin, opcode, payload):
+        """
+        Called for each frame received on the connection.
+        """
+        if opcode == frame.OP_PING:
+            self._transport.pong(payload)
+            return
+        
+        if opcode == frame.OP_PONG:
+            return
+        
+        if opcode == frame.OP_CLOSE:
+            # Echo the status code back and hang up.
+            self._transport.write(payload[:2], frame.OP_CLOSE)
+            self._transport.close(payload)
+            return
+        
+        if opcode != frame.OP_CONTINUATION:
+            self._message = []
+            self._binary = opcode == frame.OP_BINARY
+        
+        self._message.append(payload)
+        
+        if not fin:
+            return
+        
+        message = b''.join(self._message)
+        self._message = []
+        self.on_message(message, self._binary)
+    
+    def on_handshake(self):
+        """
+        The server accepted the upgrade request.
+        """
+    
+    def on_message(self, message, binary=False):
+        """
+        Called when a whole message is received.
+        """
@@ -0,0 +1,114 @@
+''' sloppy.protocol.ws.frame - photofroggy
+    WebSocket framing and handshake helpers.
+'''
+import os
+import base64
+import struct
+import hashlib
+import binascii
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def make_key():
+    """
+    Create a random value for the Sec-WebSocket-Key header.
+    """
+    return base64.b64encode(os.urandom(16))
+
+
+def accept_key(key):
+    """
+    Return the Sec-WebSocket-Accept value expected for the given key.
+    """
+    return base64.b64encode(hashlib.sha1(key + GUID).digest())
+
+
+def apply_mask(data, key):
+    """
+    XOR `data` with the 4 byte masking `key`.
+    
+    The whole payload is masked in one go by treating it as a big integer,
+    rather than looping over it byte by byte.
+    """
+    length = len(data)
+    
+    if length == 0:
+        return data
+    
+    mask = (key * (length // 4 + 1))[:length]
+    value = int(binascii.hexlify(data), 16) ^ int(binascii.hexlify(mask), 16)
+    return binascii.unhexlify('{0:0{1}x}'.format(value, length * 2))
+
+
+def encode(payload, opcode=OP_TEXT, mask=False, fin=True):
+    """
+    Wrap `payload` in a WebSocket frame.
+    
+    Clients must mask the frames they send, servers must not.
+    """
+    head = (0x80 if fin else 0) | opcode
+    length = len(payload)
+    maskbit = 0x80 if mask else 0
+    
+    if length < 126:
+        header = struct.pack('!BB', head, maskbit | length)
+    elif length < 65536:
+        header = struct.pack('!BBH', head, maskbit | 126, length)
+    else:
+        header = struct.pack('!BBQ', head, maskbit | 127, length)
+    
+    if not mask:
+        return header + payload
+    
+    key = os.urandom(4)
+    return header + key + apply_mask(payload, key)
+
+
+def decode(data, offset=0):
+    """
+    Read a frame from `data`, starting at `offset`.
+    
+    Returns `None` if `data` does not hold a whole frame yet. Otherwise, a
+    tuple of `(fin, opcode, payload, end)` is returned, where `end` is the
+    offset of the first byte after the frame.
+    """
+    if len(data) < offset + 2:
+        return None
+    
+    head, length = struct.unpack('!BB', data[offset:offset + 2])
+    masked = length & 0x80
+    length &= 0x7F
+    offset += 2
+    
+    if length == 126:
+        if len(data) < offset + 2:
+            return None
+        length = struct.unpack('!H', data[offset:offset + 2])[0]
+        offset += 2
+    elif length == 127:
+        if len(data) < offset + 8:
+            return None
+        length = struct.unpack('!Q', data[offset:offset + 8])[0]
+        offset += 8
+    
+    if masked:
+        key = data[offset:offset + 4]
+        offset += 4
+    
+    if len(data) < offset + length:
+        return None
+    
+    payload = data[offset:offset + length]
+    
+    if masked:
+        payload = apply_mask(payload, key)
+    
+    return bool(head & 0x80), head & 0x0F, payload, offset + length
@@ -0,0 +1,219 @@
+''' sloppy.protocol.ws.loadgen - photofroggy
+    WebSocket load generator.
+    
+    Opens lots of connections to a WebSocket echo service, sends messages at a
+    target rate and reports throughput and latency. Run it like this:
+        
+        python -m sloppy.protocol.ws.loadgen localhost 8000 -c 2000 -r 10000
+    
+    Make sure the open file limit (`ulimit -n`) is above the connection count.
+'''
+import sys
+import argparse
+from collections import deque
+
+from sloppy.app import Application
+from sloppy.protocol.ws import frame
+from sloppy.protocol.ws.flow import WebSocketClientFactory
+from sloppy.protocol.ws.flow import WebSocketClientProtocol
+from sloppy.protocol.ws.transport import WebSocketClient
+
+
+def percentile(values, percent):
+    """
+    Return the given percentile of a sorted list, using the nearest rank.
+    """
+    if not values:
+        return 0
+    
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class LoadFactory(WebSocketClientFactory):
+    """
+    Factory for load generator connections.
+    
+    Writes are coalesced and Nagle's algorithm is turned off, so latency
+    numbers aren't skewed by the client.
+    """
+    
+    coalesce = True
+    nodelay = True
+    
+    def init(self, app):
+        self.app = app
+    
+    def protocol(self):
+        return LoadProtocol(self)
+    
+    def fail(self, transport, reason):
+        self.app.failed += 1
+
+
+class LoadProtocol(WebSocketClientProtocol):
+    """
+    Sends messages for the load generator and times the replies.
+    """
+    
+    def __init__(self, factory):
+        WebSocketClientProtocol.__init__(self, factory)
+        self.app = factory.app
+        self.times = deque()
+    
+    def on_handshake(self):
+        self.app.ready.append(self)
+    
+    def send(self, message):
+        self.times.append(self.app.now())
+        self._transport.write(message, frame.OP_BINARY)
+    
+    def on_message(self, message, binary=False):
+        if self.times:
+            self.app.record(self.app.now() - self.times.popleft())
+    
+    def connection_closed(self, reason):
+        self.app.closed += 1
+        
+        if self in self.app.ready:
+            self.app.ready.remove(self)
+
+
+class LoadGenerator(Application):
+    """
+    Application which generates load on a WebSocket echo service.
+    """
+    
+    interval = .01
+    
+    def init(self, addr, port, connections=1000, rate=1000, duration=10,
+             size=32, path='/', drain=1):
+        self.rate = rate
+        self.duration = duration
+        self.drain = drain
+        self.message = b'x' * size
+        self.factory = LoadFactory(app=self)
+        self.ready = []
+        self.latency = []
+        self.failed = 0
+        self.closed = 0
+        self.sent = 0
+        self.received = 0
+        self.launched = self.now()
+        self.started = None
+        self.stopped = None
+        self.replied = None
+        self.next = 0
+        
+        for i in range(connections):
+            self.connect(WebSocketClient(addr, port, self.factory, path))
+        
+        self.call_later(0, self.tick)
+    
+    def record(self, latency):
+        """
+        Record the round trip time for a message.
+        """
+        self.received += 1
+        self.replied = self.now()
+        self.latency.append(latency)
+    
+    def tick(self):
+        """
+        Send however many messages are due to keep up the target rate.
+        """
+        now = self.now()
+        
+        if self.started is None:
+            # The clock starts with the first handshake, so no messages are
+            # owed for the time spent connecting.
+            if not self.ready:
+                if now - self.launched < self.duration:
+                    self.call_later(self.interval, self.tick)
+                else:
+                    self.finish()
+                return
+            
+            self.started = now
+        
+        elapsed = now - self.started
+        
+        if elapsed >= self.duration:
+            self.stopped = now
+            self.call_later(self.drain, self.finish)
+            return
+        
+        if self.ready:
+            due = int(elapsed * self.rate) - self.sent
+            
+            for i in range(due):
+                self.ready[self.next % len(self.ready)].send(self.message)
+                self.next += 1
+            
+            self.sent += max(0, due)
+        
+        self.call_later(self.interval, self.tick)
+    
+    def finish(self):
+        """
+        Stop the load generator and report the results.
+        """
+        for conn in self.conn:
+            conn[0].close()
+        
+        self.stop()
+        self.report()
+    
+    def report(self, out=sys.stdout):
+        """
+        Write the results to `out`.
+        """
+        latency = sorted(self.latency)
+        started = self.started or self.now()
+        sending = max((self.stopped or self.now()) - started, 1e-9)
+        # Replies keep arriving after sending stops, so received messages are
+        # measured up to the last reply rather than the end of the drain.
+        receiving = max((self.replied or started) - started, 1e-9)
+        lines = [
+            'connections: {0} ready, {1} failed, {2} closed'.format(
+                len(self.ready), self.failed, self.closed),
+            'messages:    {0} sent, {1} received, {2} outstanding'.format(
+                self.sent, self.received, self.sent - self.received),
+            'throughput:  {0:.1f} sent/s, {1:.1f} received/s'.format(
+                self.sent / sending, self.received / receiving),
+        ]
+        
+        for percent in (50, 90, 99, 99.9, 100):
+            lines.append('latency p{0:<5} {1:.3f} ms'.format(
+                percent, percentile(latency, percent) * 1000))
+        
+        out.write('\n'.join(lines) + '\n')
+
+
+def main(argv=None):
+    """
+    Run the load generator from the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description='Generate load on a WebSocket echo service.')
+    parser.add_argument('addr')
+    parser.add_argument('port', type=int)
+    parser.add_argument('-c', '--connections', type=int, default=1000,
+        help='number of concurrent connections')
+    parser.add_argument('-r', '--rate', type=float, default=1000,
+        help='messages sent per second, across all connections')
+    parser.add_argument('-d', '--duration', type=float, default=10,
+        help='seconds to send messages for')
+    parser.add_argument('-s', '--size', type=int, default=32,
+        help='message size in bytes')
+    parser.add_argument('-p', '--path', default='/',
+        help='request path for the upgrade request')
+    args = parser.parse_args(argv)
+    
+    app = LoadGenerator(args.addr, args.port, args.connections, args.rate,
+        args.duration, args.size, args.path)
+    app.start()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 ''' sloppy.protocol.transport - photofroggy
     WebSocket transports.
 '''
+from collections import deque
+
 from sloppy.transport import TCPServer
 from sloppy.transport import TCPClient
+from sloppy.protocol.ws import frame
 from sloppy.protocol.ws.flow import WebSocketServerFactory
+from sloppy.protocol.ws.flow import WebSocketClientFactory
 
 
 class WebSocketServer(TCPServer):
@@ -26,19 +30,9 @@ class WebSocketServer(TCPServer):
         self.port = port
         self.factory = factory or WebSocketServerFactory(protocol)
         self._transport = transport or WebSocketClient
+        self._wbuffer = deque()
+        self.connections = 0
         self.init(addr, port, factory, transport, *args, **kwargs)
-    
-    def read(self, bytes=0):
-        """
-        Accept an incoming connection.
-        
-        This method accepts connections instead of reading data, as this
-        transport is used for serving a port on a server.
-        """
-        incoming, addr = self.conn.accept()
-        transport = self._transport(addr, self.port, self.factory)
-        transport.conn = incoming
-        return transport
 
 
 class WebSocketClient(TCPClient):
@@ -46,6 +40,113 @@ class WebSocketClient(TCPClient):
     Transport for WebSocket clients.
     
     This transport wraps a socket connection to a remote host. Messages sent
-    are wrapped appropriately according to the WebSocket standard 
+    are wrapped appropriately according to the WebSocket standard.
+    
+    This transport is also used for connections accepted by WebSocketServer.
+    Frames are only masked when this transport opened the connection.
     """
-
+    
+    key = None
+    accept = None
+    handshaked = False
+    
+    def __init__(self, addr, port, factory=None, *args, **kwargs):
+        """
+        Create a transport.
+        """
+        TCPClient.__init__(self, addr, port,
+            factory or WebSocketClientFactory(), *args, **kwargs)
+    
+    def init(self, addr, port, factory=None, path='/', origin=None, protocols=None):
+        """
+        Store the details used for the upgrade request.
+        """
+        self.path = path
+        self.origin = origin
+        self.protocols = protocols or []
+        self.mask = False
+        self.handshaked = False
+    
+    def connect(self):
+        """
+        Open a connection and send the upgrade request.
+        
+        Returns `True` on success, `False` on failure.
+        """
+        self.mask = True
+        self.handshaked = False
+        
+        if not TCPClient.connect(self):
+            return False
+        
+        self.handshake()
+        return True
+    
+    def handshake(self):
+        """
+        Send the upgrade request for the connection.
+        """
+        self.key = frame.make_key()
+        self.accept = frame.accept_key(self.key)
+        
+        host = self.addr
+        if self.port not in (80, 443):
+            host = '{0}:{1}'.format(self.addr, self.port)
+        
+        lines = [
+            'GET {0} HTTP/1.1'.format(self.path),
+            'Host: {0}'.format(host),
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Key: {0}'.format(self.key.decode()),
+            'Sec-WebSocket-Version: 13',
+        ]
+        
+        if self.origin is not None:
+            lines.append('Origin: {0}'.format(self.origin))
+        
+        if self.protocols:
+            lines.append('Sec-WebSocket-Protocol: {0}'.format(
+                ', '.join(self.protocols)))
+        
+        self.write_raw(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    
+    def verify(self, accept):
+        """
+        Return `True` if `accept` is the Sec-WebSocket-Accept value expected
+        for our key.
+        """
+        if self.accept is None or accept is None:
+            return False
+        
+        if not isinstance(accept, bytes):
+            accept = accept.encode()
+        
+        return accept.strip() == self.accept
+    
+    def write_raw(self, data):
+        """
+        Write data to the connection without wrapping it in a frame.
+        """
+        return TCPClient.write(self, data)
+    
+    def write(self, data, opcode=frame.OP_TEXT):
+        """
+        Write a message to the connection.
+        
+        The message is wrapped in a frame, which is masked if we are the
+        client. Returns the number of bytes written to the connection.
+        """
+        return self.write_raw(frame.encode(data, opcode, self.mask))
+    
+    def ping(self, data=b''):
+        """
+        Send a ping frame.
+        """
+        return self.write(data, frame.OP_PING)
+    
+    def pong(self, data=b''):
+        """
+        Send a pong frame.
+        """
+        return self.write(data, frame.OP_PONG)
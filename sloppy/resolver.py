@@ -0,0 +1,113 @@
+''' sloppy.resolver - photofroggy
+    Caching host name resolution.
+'''
+import time
+import socket
+
+
+class Resolver(object):
+    """
+    Resolve host names to addresses, caching the results.
+    
+    Lookups are done with `getaddrinfo`, so both IPv4 and IPv6 addresses are
+    returned. Results are cached for `ttl` seconds, as `getaddrinfo` does not
+    tell us the real TTL of the records.
+    
+    The order addresses are tried in depends on the `strategy` used. With
+    'roundrobin', each lookup starts at the next address in the list. With
+    'failover', the same address is used until it fails, at which point it is
+    moved to the end of the list.
+    """
+    
+    ROUNDROBIN = 'roundrobin'
+    FAILOVER = 'failover'
+    
+    def __init__(self, ttl=300, strategy=ROUNDROBIN, family=socket.AF_UNSPEC):
+        """
+        Create a resolver.
+        """
+        if strategy not in (self.ROUNDROBIN, self.FAILOVER):
+            raise ValueError('Unknown resolver strategy: {0}'.format(strategy))
+        
+        self.ttl = ttl
+        self.strategy = strategy
+        self.family = family
+        self.cache = {} # { (host, port): [ expires, [ address, ... ] ] }
+    
+    def now(self):
+        """
+        Return the current time.
+        """
+        return time.time()
+    
+    def lookup(self, host, port):
+        """
+        Return the cached list of addresses for `host` and `port`.
+        
+        Each address is a tuple of `(family, socktype, proto, sockaddr)`. A
+        fresh lookup is done if there is nothing cached or the cached entry has
+        expired. Raises `socket.gaierror` if the host can't be resolved.
+        """
+        key = (host, port)
+        entry = self.cache.get(key, None)
+        
+        if entry is not None and entry[0] > self.now():
+            return entry[1]
+        
+        info = socket.getaddrinfo(host, port, self.family, socket.SOCK_STREAM)
+        addresses = []
+        
+        for family, socktype, proto, canonname, sockaddr in info:
+            address = (family, socktype, proto, sockaddr)
+            if address not in addresses:
+                addresses.append(address)
+        
+        self.cache[key] = [ self.now() + self.ttl, addresses ]
+        return addresses
+    
+    def addresses(self, host, port):
+        """
+        Return the addresses for `host` and `port` in the order they should be
+        tried.
+        """
+        addresses = self.lookup(host, port)
+        ordered = list(addresses)
+        
+        if self.strategy == self.ROUNDROBIN and len(addresses) > 1:
+            # Rotate the cached list, so the next lookup starts elsewhere.
+            addresses.append(addresses.pop(0))
+        
+        return ordered
+    
+    def failed(self, host, port, address):
+        """
+        Report that connecting to `address` failed.
+        
+        When using failover, the address is moved to the end of the list.
+        """
+        if self.strategy != self.FAILOVER:
+            return
+        
+        entry = self.cache.get((host, port), None)
+        
+        if entry is None or address not in entry[1]:
+            return
+        
+        entry[1].remove(address)
+        entry[1].append(address)
+    
+    def expire(self, host=None):
+        """
+        Remove cached entries for `host`, or everything if no host is given.
+        """
+        if host is None:
+            self.cache = {}
+            return
+        
+        for key in list(self.cache.keys()):
+            if key[0] == host:
+                del self.cache[key]
+
+
+# Shared resolver used by transports when the factory doesn't provide one.
+resolver = Resolver()
@@ -1,11 +1,61 @@
 ''' sloppy.transport - photofroggy
     Default transports and base.
 '''
+import os
 import socket
 import errno
+from collections import deque
 
 from sloppy.flow import ServerFactory
 from sloppy.flow import ConnectionFactory
+from sloppy import resolver
+
+
+def would_block(e):
+    """
+    Return `True` if the socket error `e` only means the call would block.
+    """
+    return ((e.args[0] == 'timed out')
+        or (e.args[0] == errno.EAGAIN)
+        or (os.name == 'nt' and e.args[0] == errno.WSAEWOULDBLOCK)
+        or (e.args[0] == errno.EINTR))
+
+
+def out_of_resources(e):
+    """
+    Return `True` if the socket error `e` means there were no descriptors or
+    memory left for the call.
+    """
+    return e.args[0] in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS,
+        errno.ENOMEM)
+
+
+def in_progress(error):
+    """
+    Return `True` if the `connect_ex` result `error` means the connection is
+    still being established.
+    """
+    return ((error == errno.EINPROGRESS)
+        or (error == errno.EWOULDBLOCK)
+        or (error == errno.EALREADY)
+        or (os.name == 'nt' and error == errno.WSAEWOULDBLOCK))
+
+
+def setsockopt(sock, level, option, value):
+    """
+    Set a socket option, ignoring options the platform doesn't support.
+    
+    Returns `True` if the option was set.
+    """
+    if option is None or value is None:
+        return False
+    
+    try:
+        sock.setsockopt(level, option, int(value))
+    except socket.error:
+        return False
+    
+    return True
 
 
 class Transport(object):
@@ -20,6 +70,14 @@ class Transport(object):
     port = None
     factory = None
     dcreason = None
+    corked = False
+    coalesce = False
+    blocked = False
+    connecting = False
+    paused = False
+    server = None
+    loop = None
+    batch_size = 65536
     
     def __init__(self, addr, port, factory=None, *args, **kwargs):
         """
@@ -29,6 +87,9 @@ class Transport(object):
         self.port = port
         self.factory = factory or ConnectionFactory()
         self.dcreason = None
+        self.corked = False
+        self.coalesce = getattr(self.factory, 'coalesce', False)
+        self._wbuffer = deque()
         self.init(addr, port, factory, *args, **kwargs)
     
     def init(self, addr, port, factory=None, *args, **kwargs):
@@ -55,10 +116,149 @@ class Transport(object):
         """
         Write data to the transport.
         
-        Return the number of bytes written to the connection.
+        If the transport is corked, coalescing writes, still connecting, or
+        still has data waiting, the data is buffered and the number of bytes
+        buffered is returned. Otherwise, the data is sent and the number of bytes written
+        to the connection is returned. Anything which couldn't be sent is
+        kept for the next flush.
+        """
+        if self.conn is None:
+            return 0
+        
+        if self.corked or self.coalesce or self.connecting or self._wbuffer:
+            self.queue(data)
+            return len(data)
+        
+        sent = self.send(data)
+        
+        if 0 <= sent < len(data):
+            # Keep the rest until the connection can take it.
+            self.queue(memoryview(data)[sent:])
+            self.blocked = True
+        
+        return sent
+    
+    def send(self, data):
+        """
+        Send data on the connection straight away.
+        
+        Child classes should override this. Return the number of bytes sent,
+        which may be less than given if the connection would block, or -1 if
+        an error occurs.
         """
         return 0
     
+    def cork(self):
+        """
+        Stop sending data written to the transport.
+        
+        Writes are buffered until `uncork` is called.
+        """
+        self.corked = True
+    
+    def uncork(self):
+        """
+        Send any data buffered while the transport was corked.
+        
+        Return the number of bytes written to the connection.
+        """
+        self.corked = False
+        return self.flush()
+    
+    def queue(self, data):
+        """
+        Buffer data to be sent by the next flush.
+        """
+        if not self._wbuffer and self.loop is not None:
+            self.loop.writing(self)
+        self._wbuffer.append(data)
+    
+    def pending(self):
+        """
+        Return `True` if there is buffered data waiting to be flushed.
+        """
+        return (not self.corked and not self.connecting
+            and len(self._wbuffer) > 0)
+    
+    def buffered(self):
+        """
+        Return the number of bytes waiting to be sent.
+        """
+        return sum(len(data) for data in self._wbuffer)
+    
+    def next_batch(self):
+        """
+        Take the next batch of buffered data to send.
+        
+        Small chunks are joined until there are `batch_size` bytes, so lots of
+        small writes go out in one call without copying the whole backlog.
+        """
+        data = self._wbuffer.popleft()
+        
+        if len(data) >= self.batch_size or not self._wbuffer:
+            return data
+        
+        chunks = [data]
+        size = len(data)
+        
+        while self._wbuffer and size < self.batch_size:
+            data = self._wbuffer.popleft()
+            chunks.append(data)
+            size += len(data)
+        
+        return b''.join(chunks)
+    
+    def flush(self):
+        """
+        Send any buffered data.
+        
+        Batches are sent until the connection stops taking data. Whatever is
+        left of a batch stays at the front of the buffer without being
+        copied, and the transport is marked as blocked until the connection
+        can take more. Returns the number of bytes written to the connection.
+        """
+        if self.conn is None or self.connecting or not self._wbuffer:
+            return 0
+        
+        total = 0
+        
+        while self._wbuffer:
+            data = self.next_batch()
+            sent = self.send(data)
+            
+            if sent < 0:
+                self._wbuffer.clear()
+                self.blocked = False
+                return sent
+            
+            total += sent
+            
+            if sent < len(data):
+                self._wbuffer.appendleft(memoryview(data)[sent:])
+                self.blocked = True
+                return total
+        
+        self.blocked = False
+        return total
+    
+    def tune(self, nodelay=None, quickack=None, sndbuf=None, rcvbuf=None):
+        """
+        Set socket options on the connection.
+        
+        Options given as `None` are left alone. Options which are not
+        supported by the platform are ignored.
+        """
+    
+    def configure(self):
+        """
+        Apply the socket options given by the factory to the connection.
+        """
+        self.tune(
+            nodelay=getattr(self.factory, 'nodelay', None),
+            quickack=getattr(self.factory, 'quickack', None),
+            sndbuf=getattr(self.factory, 'sndbuf', None),
+            rcvbuf=getattr(self.factory, 'rcvbuf', None))
+    
     def close(self, reason=None):
         """
         Close connection.
@@ -71,6 +271,10 @@ class Transport(object):
         """
         Connection has been closed and removed from the main loop.
         """
+        if self.server is not None:
+            self.server.release(self)
+            self.server = None
+        
         return self.factory.closed(self, reason)
     
     def read(self, bytes=0):
@@ -96,52 +300,208 @@ class TCPClient(Transport):
     to read and write data on the socket.
     """
     
+    _quickack = False
+    _kcork = False
+    
     def connect(self):
         """
-        Open a connection.
+        Start opening a connection.
         
-        Returns `True` on success, `False` on failure.
+        Each address the host resolves to is tried in turn, in the order given
+        by the factory's resolver, until one of them accepts the connection.
+        The socket is non-blocking, so the connection may still be in progress
+        when this returns, in which case `connecting` is `True`. The
+        application calls `check_connect` once the socket is writable, or
+        `abandon` if the address doesn't answer within the factory's
+        `connect_timeout`.
+        
+        Returns `True` if the connection is open or in progress, `False` if
+        every address failed.
         """
         self.factory.starting()
         self.conn = None
+        self.dcreason = None
+        # The transport may be reused to reconnect, and nothing left over
+        # from the last connection should go out on the new one.
+        self._wbuffer.clear()
+        self.corked = False
+        self.blocked = False
+        self._kcork = False
+        
+        self._dns = getattr(self.factory, 'resolver', None) or resolver.resolver
         
         try:
-            self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.conn.connect((socket.gethostbyname(self.addr), self.port))
-            self.conn.setblocking(0)
-            self.conn.settimeout(.5)
+            self._addresses = self._dns.addresses(self.addr, self.port)
         except socket.error as e:
-            self.conn = None
             self.factory.fail(self, e)
             return False
         
-        self.factory.connected(self)
-        return True
+        self._error = socket.error('No addresses found for {0}'.format(self.addr))
+        return self.connect_next()
     
-    def write(self, data):
+    def connect_next(self):
         """
-        Write some data to the connection.
+        Start connecting to the next address.
         
-        Returns the number of bytes written to the connection.
+        Returns `True` if the connection is open or in progress, `False` if
+        there are no addresses left to try.
+        """
+        while self._addresses:
+            address = self._addresses.pop(0)
+            
+            try:
+                self.conn = socket.socket(address[0], address[1], address[2])
+                # Buffer sizes have to be set before connecting to affect the
+                # window scaling negotiated in the handshake.
+                self.configure()
+                self.conn.setblocking(0)
+                error = self.conn.connect_ex(address[3])
+            except socket.error as e:
+                error = e
+            
+            if error == 0:
+                self.connecting = False
+                self.factory.connected(self)
+                return True
+            
+            if in_progress(error):
+                self._address = address
+                self.connecting = True
+                return True
+            
+            self.drop(address, error)
+        
+        self.connecting = False
+        self.factory.fail(self, self._error)
+        return False
+    
+    def check_connect(self):
         """
-        if self.conn is None:
-            return 0
+        Finish connecting, once the socket is writable.
+        
+        If the connection failed, the next address is tried. Returns `True`
+        if the connection is open or still in progress, `False` if every
+        address failed.
+        """
+        error = self.conn.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        
+        if error == 0:
+            self.connecting = False
+            self.factory.connected(self)
+            return True
+        
+        self.drop(self._address, error)
+        return self.connect_next()
+    
+    def abandon(self, reason):
+        """
+        Give up on the address being connected to, and try the next one.
+        
+        Returns like `check_connect`.
+        """
+        self.drop(self._address, reason)
+        return self.connect_next()
+    
+    def drop(self, address, error):
+        """
+        Close the socket for an address which couldn't be connected to.
+        """
+        if not isinstance(error, Exception):
+            error = socket.error(error, os.strerror(error))
         
+        if self.conn is not None:
+            self.conn.close()
+        
+        self.conn = None
+        self._dns.failed(self.addr, self.port, address)
+        self._error = error
+    
+    def send(self, data):
+        """
+        Send some data on the socket.
+        
+        Returns the number of bytes written to the connection, 0 if the socket
+        would block, or -1 if an error occurs.
+        """
         try:
-            sent = self.conn.send( data )
-            return sent
-        except socket.error:
+            return self.conn.send( data )
+        except socket.error as e:
+            if would_block(e):
+                return 0
             return -1
     
+    def tune(self, nodelay=None, quickack=None, sndbuf=None, rcvbuf=None):
+        """
+        Set socket options on the connection.
+        
+        Options given as `None` are left alone. Options which are not
+        supported by the platform are ignored.
+        """
+        if self.conn is None:
+            return
+        
+        setsockopt(self.conn, socket.IPPROTO_TCP,
+            getattr(socket, 'TCP_NODELAY', None), nodelay)
+        setsockopt(self.conn, socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        setsockopt(self.conn, socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        
+        if quickack is not None:
+            # Linux clears TCP_QUICKACK after some reads, so remember it, but
+            # only if the platform actually supports it.
+            self._quickack = bool(quickack) and setsockopt(self.conn,
+                socket.IPPROTO_TCP, getattr(socket, 'TCP_QUICKACK', None),
+                quickack)
+    
+    def cork(self):
+        """
+        Stop sending data written to the transport.
+        
+        If the factory's `cork` option is set, TCP_CORK is set on the socket
+        instead, and writes go straight to the socket. The kernel holds them
+        back until `uncork`, so they are sent in full segments without being
+        buffered here.
+        """
+        if (getattr(self.factory, 'cork', None) and self.conn is not None
+            and setsockopt(self.conn, socket.IPPROTO_TCP,
+                getattr(socket, 'TCP_CORK', None), 1)):
+                    self._kcork = True
+                    return
+        
+        Transport.cork(self)
+    
+    def uncork(self):
+        """
+        Send any data held back while the transport was corked.
+        
+        TCP_CORK is cleared after the flush, so the last partial segment goes
+        out straight away. Return the number of bytes written to the
+        connection.
+        """
+        sent = Transport.uncork(self)
+        
+        if self._kcork:
+            self._kcork = False
+            setsockopt(self.conn, socket.IPPROTO_TCP,
+                getattr(socket, 'TCP_CORK', None), 0)
+        
+        return sent
+    
     def close(self, reason=None):
         """
         Close the connection.
+        
+        Any data still buffered is sent if the socket will take it, before
+        the socket is closed.
         """
+        self.corked = False
+        
         try:
+            self.flush()
             self.conn.close()
         except socket.error:
             pass
         self.conn = None
+        self.connecting = False
         self.dcreason = reason
     
     def read(self, bytes=0):
@@ -158,14 +518,15 @@ class TCPClient(Transport):
         try:
             data = self.conn.recv(bytes)
         except socket.error as e:
-            if ((e.args[0] == 'timed out')
-                or (e.args[0] == errno.EAGAIN)
-                or (os.name == 'nt' and e.args[0] == errno.WSAEWOULDBLOCK)
-                or (e.args[0] == errno.EINTR)):
-                    return None
+            if would_block(e):
+                return None
             elif self.conn and e.args[0]:
                 return e
         
+        if data and self._quickack:
+            setsockopt(self.conn, socket.IPPROTO_TCP,
+                getattr(socket, 'TCP_QUICKACK', None), 1)
+        
         return data or False
 
 
@@ -176,8 +537,20 @@ class TCPServer(Transport):
     This transport provides functionality allowing applications to serve
     requests on a port. The object creates new TCPClient objects for new
     connections received, and passes these objects to the application loop.
+    
+    The number of connections accepted which are still open is kept in
+    `connections`, so the application can limit how many the server takes.
+    
+    If accepting fails because descriptors or memory ran out, the server is
+    marked `exhausted` until one of its connections is released, or until
+    the factory's `retry_accept` seconds have passed.
     """
     
+    listening = True
+    connections = 0
+    exhausted = False
+    _retry = None
+    
     def __init__(self, addr, port, factory=None, transport=None, protocol=None, *args, **kwargs):
         """
         Create a transport.
@@ -187,6 +560,8 @@ class TCPServer(Transport):
         self.port = port
         self.factory = factory or ServerFactory(protocol)
         self._transport = transport or TCPClient
+        self._wbuffer = deque()
+        self.connections = 0
         self.init(addr, port, factory, transport, *args, **kwargs)
     
     def connect(self):
@@ -198,9 +573,10 @@ class TCPServer(Transport):
         
         try:
             self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Accepted sockets inherit the buffer sizes set here.
+            self.configure()
             self.conn.bind((socket.gethostbyname(self.addr), self.port))
             self.conn.setblocking(0)
-            self.conn.settimeout(.5)
             self.conn.listen(5)
         except socket.error as e:
             self.conn = None
@@ -214,6 +590,8 @@ class TCPServer(Transport):
         """
         Stop serving requests.
         """
+        self.recover()
+        
         try:
             self.conn.close()
         except socket.error:
@@ -221,15 +599,81 @@ class TCPServer(Transport):
         self.conn = None
         self.dcreason = reason
     
+    def write(self, data):
+        """
+        Listening sockets can't send data, so nothing is written.
+        """
+        return 0
+    
+    def tune(self, nodelay=None, quickack=None, sndbuf=None, rcvbuf=None):
+        """
+        Set the buffer sizes on the listening socket.
+        
+        This has to happen before `listen`, so the sizes are in place when
+        the window scaling of accepted connections is negotiated. The other
+        options are applied to each accepted connection.
+        """
+        if self.conn is None:
+            return
+        
+        setsockopt(self.conn, socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        setsockopt(self.conn, socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    
     def read(self, bytes=0):
         """
         Accept an incoming connection.
         
         This method accepts connections instead of reading data, as this
-        transport is used for serving a port on a server.
+        transport is used for serving a port on a server. Returns `None` if
+        there was no connection waiting after all, or if it couldn't be
+        accepted for the time being.
         """
-        incoming, addr = self.conn.accept()
+        try:
+            incoming, addr = self.conn.accept()
+        except socket.error as e:
+            if would_block(e) or e.args[0] == errno.ECONNABORTED:
+                # Nothing waiting, or it went away before we got to it.
+                return None
+            if out_of_resources(e):
+                # The connection waits in the backlog until we can take it.
+                self.exhaust()
+                return None
+            return e
+        
+        incoming.setblocking(0)
         transport = self._transport(addr, self.port, self.factory)
         transport.conn = incoming
+        transport.server = self
+        transport.configure()
         return transport
+    
+    def release(self, transport):
+        """
+        A connection accepted by this server has been closed.
+        """
+        self.connections = max(0, self.connections - 1)
+        self.recover()
+    
+    def exhaust(self):
+        """
+        Stop accepting connections until there are resources for them.
+        
+        The descriptors may be held by something other than this server, so
+        accepting is tried again after `retry_accept` seconds regardless.
+        """
+        self.exhausted = True
+        
+        if self.loop is not None and self._retry is None:
+            delay = getattr(self.factory, 'retry_accept', 1.0)
+            self._retry = self.loop.call_later(delay, self.recover)
+    
+    def recover(self):
+        """
+        Start accepting connections again.
+        """
+        self.exhausted = False
+        
+        if self._retry is not None:
+            self.loop.cancel(self._retry)
+            self._retry = None
 
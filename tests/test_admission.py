@@ -0,0 +1,218 @@
+import errno
+import socket
+import unittest
+
+from sloppy.app import Application
+from sloppy.flow import Protocol
+from sloppy.flow import ServerFactory
+from sloppy.loopback import LoopbackTransport
+from sloppy.loopback import SimulatedApplication
+from sloppy.transport import TCPServer
+
+
+class Factory(ServerFactory):
+    
+    def init(self):
+        self.admits = 0
+        self.refuse = False
+        self.closes = []
+    
+    def admit(self, server, app):
+        self.admits += 1
+        return not self.refuse
+    
+    def closed(self, transport, reason):
+        self.closes.append(reason)
+
+
+class Server(object):
+    """
+    Stands in for a listening transport.
+    """
+    
+    listening = True
+    paused = False
+    
+    def __init__(self, factory):
+        self.factory = factory
+        self.conn = object()
+        self.connections = 0
+    
+    def release(self, transport):
+        self.connections -= 1
+
+
+class AdmissionTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.app = Application()
+        self.factory = Factory(Protocol)
+        self.server = Server(self.factory)
+        self.app.servers.append(self.server)
+    
+    def incoming(self):
+        transport = LoopbackTransport('loopback', 0, self.factory)
+        transport.connect()
+        transport.server = self.server
+        return transport
+    
+    def test_server_limit(self):
+        self.factory.max_connections = 2
+        self.server.connections = 1
+        self.assertIsNone(self.app.overloaded(self.server))
+        
+        self.server.connections = 2
+        self.assertEqual(self.app.overloaded(self.server),
+            'Too many connections on server')
+    
+    def test_global_limit_counts_admitted_connections(self):
+        other = Server(Factory(Protocol))
+        other.connections = 2
+        self.app.servers.append(other)
+        self.app.max_connections = 3
+        self.assertIsNone(self.app.overloaded(self.server))
+        
+        self.server.connections = 1
+        self.assertEqual(self.app.overloaded(self.server),
+            'Too many connections')
+    
+    def test_factory_cannot_loosen_global_limits(self):
+        self.app.max_lag = .1
+        self.factory.max_lag = 10
+        self.app.lag = 1
+        self.assertEqual(self.app.overloaded(self.server),
+            'Application loop lagging')
+        
+        self.app.max_outbound = 100
+        self.factory.max_outbound = 10000
+        self.app.lag = 0
+        self.app.outbound = 1000
+        self.assertEqual(self.app.overloaded(self.server),
+            'Too much outbound data')
+    
+    def test_zero_limit_is_a_limit(self):
+        self.factory.max_outbound = 0
+        self.app.outbound = 1
+        self.assertEqual(self.app.overloaded(self.server),
+            'Too much outbound data')
+    
+    def test_reject_closes_connection(self):
+        self.factory.overload = 'reject'
+        self.factory.refuse = True
+        transport = self.incoming()
+        self.app.accept(transport)
+        
+        self.assertIsNone(transport.conn)
+        self.assertEqual(self.app.conn, [])
+        self.assertEqual(self.server.connections, 0)
+        self.assertEqual(self.factory.closes, ['Refused by factory'])
+    
+    def test_pause_never_sheds_in_accept(self):
+        self.factory.refuse = True
+        transport = self.incoming()
+        self.app.accept(transport)
+        
+        self.assertIs(transport.conn, transport)
+        self.assertEqual(len(self.app.conn), 1)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.factory.admits, 0)
+    
+    def test_admission_pauses_and_resumes(self):
+        self.factory.refuse = True
+        self.app.admission()
+        self.assertTrue(self.server.paused)
+        self.assertEqual(self.factory.admits, 1)
+        
+        self.factory.refuse = False
+        self.app.admission()
+        self.assertFalse(self.server.paused)
+    
+    def test_reject_servers_are_never_paused(self):
+        self.factory.overload = 'reject'
+        self.factory.refuse = True
+        self.app.admission()
+        
+        self.assertFalse(self.server.paused)
+        self.assertEqual(self.factory.admits, 0)
+
+
+class Failing(object):
+    """
+    Stands in for a listening socket which can't accept connections.
+    """
+    
+    def __init__(self, error):
+        self.error = error
+    
+    def accept(self):
+        raise socket.error(self.error, 'accept failed')
+    
+    def close(self):
+        pass
+
+
+class ExhaustionTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.app = SimulatedApplication()
+        self.factory = Factory(Protocol)
+        self.server = TCPServer('127.0.0.1', 0, self.factory)
+        self.server.conn = Failing(errno.EMFILE)
+        self.server.loop = self.app
+        self.app.servers.append(self.server)
+    
+    def test_out_of_descriptors_pauses(self):
+        for error in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+            self.server.conn.error = error
+            self.assertIsNone(self.server.read())
+            self.app.admission()
+            self.assertTrue(self.server.paused)
+            
+            self.server.recover()
+            self.app.admission()
+            self.assertFalse(self.server.paused)
+    
+    def test_reject_servers_pause_too(self):
+        self.factory.overload = 'reject'
+        self.server.read()
+        self.app.admission()
+        
+        self.assertTrue(self.server.paused)
+    
+    def test_release_resumes(self):
+        self.server.connections = 1
+        self.server.read()
+        self.server.release(None)
+        self.app.admission()
+        
+        self.assertFalse(self.server.paused)
+        self.assertEqual(self.app.timers[0][2], None)
+    
+    def test_retries_after_delay(self):
+        self.factory.retry_accept = 2
+        self.server.read()
+        self.server.read()
+        self.assertEqual(len(self.app.timers), 1)
+        
+        self.app.advance(1)
+        self.app.admission()
+        self.assertTrue(self.server.paused)
+        
+        self.app.advance(1)
+        self.app.admission()
+        self.assertFalse(self.server.paused)
+    
+    def test_aborted_connection_is_skipped(self):
+        self.server.conn.error = errno.ECONNABORTED
+        
+        self.assertIsNone(self.server.read())
+        self.assertFalse(self.server.exhausted)
+    
+    def test_other_errors_are_returned(self):
+        self.server.conn.error = errno.EBADF
+        
+        self.assertIsInstance(self.server.read(), socket.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
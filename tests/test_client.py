@@ -0,0 +1,290 @@
+import socket
+import select
+import unittest
+
+from sloppy.app import Application
+from sloppy.flow import ConnectionFactory
+from sloppy.flow import ReconnectingClientFactory
+from sloppy.loopback import SimulatedApplication
+from sloppy.resolver import Resolver
+from sloppy.transport import TCPClient
+from sloppy.protocol.ws.transport import WebSocketClient
+
+
+def connect(transport):
+    """
+    Connect a client transport, waiting for the connection to finish like
+    the application would.
+    """
+    if not transport.connect():
+        return False
+    
+    while transport.connecting:
+        select.select([], [transport.conn], [], 2)
+        if not transport.check_connect():
+            return False
+    
+    # Flush anything written while connecting.
+    transport.flush()
+    return True
+
+
+class Listener(object):
+    """
+    Listening socket on localhost which accepts connections on demand.
+    """
+    
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.accepted = []
+    
+    def accept(self):
+        self.sock.settimeout(2)
+        conn = self.sock.accept()[0]
+        conn.settimeout(2)
+        self.accepted.append(conn)
+        return conn
+    
+    def close(self):
+        for conn in self.accepted:
+            conn.close()
+        self.sock.close()
+
+
+def address(port):
+    return (socket.AF_INET, socket.SOCK_STREAM, 6, ('127.0.0.1', port))
+
+
+class Factory(ConnectionFactory):
+    
+    def __init__(self, app, *addresses):
+        self.app = app
+        self.resolver = Resolver(strategy=Resolver.FAILOVER)
+        self.resolver.cache[('server', 0)] = [float('inf'), list(addresses)]
+        self.failure = None
+    
+    def connected(self, transport):
+        self.app.stop()
+    
+    def fail(self, transport, reason):
+        self.failure = reason
+        self.app.stop()
+
+
+class App(Application):
+    """
+    Application which stops once the client connects or fails, and counts
+    the timer ticks it gets through while waiting.
+    """
+    
+    def init(self):
+        self.ticks = 0
+        self.call_later(.01, self.tick)
+        self.call_later(5, self.stop)
+    
+    def tick(self):
+        self.ticks += 1
+        self.call_later(.01, self.tick)
+
+
+class ConnectTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.listener = Listener()
+        self.app = App()
+    
+    def tearDown(self):
+        self.listener.close()
+    
+    def closed_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+    
+    def run_client(self, factory):
+        transport = TCPClient('server', 0, factory)
+        self.app.connect(transport)
+        self.app.start()
+        return transport
+    
+    def test_falls_back_to_next_address(self):
+        refused = address(self.closed_port())
+        factory = Factory(self.app, refused, address(self.listener.port))
+        transport = self.run_client(factory)
+        
+        self.assertIsNone(factory.failure)
+        self.assertEqual(transport.conn.getpeername()[1], self.listener.port)
+        # Failover puts the address which refused us at the back.
+        self.assertEqual(factory.resolver.addresses('server', 0)[-1], refused)
+    
+    def test_every_address_fails(self):
+        factory = Factory(self.app, address(self.closed_port()))
+        transport = self.run_client(factory)
+        
+        self.assertIsNotNone(factory.failure)
+        self.assertIsNone(transport.conn)
+        self.assertEqual(self.app.connects, {})
+    
+    def test_slow_address_times_out_without_blocking(self):
+        # A listener with a full backlog never answers new connections.
+        full = socket.socket()
+        full.bind(('127.0.0.1', 0))
+        full.listen(0)
+        backlog = []
+        
+        for i in range(4):
+            sock = socket.socket()
+            sock.setblocking(0)
+            sock.connect_ex(full.getsockname())
+            backlog.append(sock)
+        
+        factory = Factory(self.app, address(full.getsockname()[1]),
+            address(self.listener.port))
+        factory.connect_timeout = .2
+        
+        try:
+            transport = self.run_client(factory)
+        finally:
+            for sock in backlog:
+                sock.close()
+            full.close()
+        
+        self.assertEqual(transport.conn.getpeername()[1], self.listener.port)
+        # Timers kept running while the first address was tried.
+        self.assertTrue(self.app.ticks > 5)
+
+
+class ReconnectTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.listener = Listener()
+    
+    def tearDown(self):
+        self.listener.close()
+    
+    def test_leftover_writes_are_dropped(self):
+        transport = TCPClient('127.0.0.1', self.listener.port,
+            ConnectionFactory())
+        self.assertTrue(connect(transport))
+        self.listener.accept()
+        
+        # Lost with data still waiting to be sent.
+        transport.cork()
+        transport.write(b'stale')
+        transport.conn.close()
+        
+        self.assertTrue(connect(transport))
+        self.assertFalse(transport.corked)
+        self.assertEqual(transport.buffered(), 0)
+        
+        transport.write(b'fresh')
+        self.assertEqual(self.listener.accept().recv(10), b'fresh')
+        transport.close()
+    
+    def test_upgrade_request_goes_first(self):
+        transport = WebSocketClient('127.0.0.1', self.listener.port)
+        self.assertTrue(connect(transport))
+        self.listener.accept()
+        
+        transport.cork()
+        transport.write(b'stale')
+        transport.conn.close()
+        
+        self.assertTrue(connect(transport))
+        self.assertEqual(self.listener.accept().recv(4), b'GET ')
+        transport.close()
+
+
+
+class Reconnecting(ReconnectingClientFactory):
+    
+    jitter = 0
+    
+    def init(self):
+        self.given_up = 0
+    
+    def give_up(self, transport):
+        self.given_up += 1
+
+
+class ReconnectingFactoryTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.app = SimulatedApplication()
+        self.factory = Reconnecting(self.app)
+        self.transport = TCPClient('server', 80, self.factory)
+    
+    def delays(self, count):
+        delays = []
+        
+        for i in range(count):
+            self.factory.retry(self.transport)
+            delays.append(self.factory._timer[0] - self.app.now())
+        
+        return delays
+    
+    def test_backoff_grows_to_max_delay(self):
+        self.factory.max_delay = 10
+        self.assertEqual(self.delays(6), [1, 2, 4, 8, 10, 10])
+    
+    def test_connected_resets_delay(self):
+        self.delays(3)
+        self.factory.connected(self.transport)
+        
+        self.assertEqual(self.factory.retries, 0)
+        self.assertEqual(self.delays(1), [1])
+    
+    def test_jitter_bounds(self):
+        self.factory.jitter = .5
+        
+        for i in range(200):
+            self.factory.delay = 8
+            delay = self.factory.next_delay()
+            self.assertTrue(4 <= delay <= 12, delay)
+            self.assertEqual(self.factory.delay, 16)
+    
+    def test_jitter_stays_under_max_delay(self):
+        self.factory.jitter = .5
+        self.factory.max_delay = 10
+        
+        for i in range(200):
+            self.factory.delay = 10
+            self.assertTrue(self.factory.next_delay() <= 10)
+    
+    def test_reconnects_on_the_loop(self):
+        self.factory.fail(self.transport, None)
+        self.assertEqual(self.app.cqueue, [])
+        
+        self.app.advance(1)
+        self.assertEqual(self.app.cqueue, [[self.transport]])
+        self.assertIsNone(self.factory._timer)
+    
+    def test_max_retries_gives_up(self):
+        self.factory.max_retries = 2
+        self.delays(2)
+        self.factory.closed(self.transport, None)
+        
+        self.assertEqual(self.factory.given_up, 1)
+        self.assertEqual(len(self.app.timers), 2)
+    
+    def test_stop_trying_cancels_timer(self):
+        self.factory.fail(self.transport, None)
+        timer = self.factory._timer
+        self.factory.stop_trying()
+        
+        self.assertIsNone(timer[2])
+        self.assertIsNone(self.factory._timer)
+        
+        self.app.advance(60)
+        self.factory.fail(self.transport, None)
+        self.app.advance(60)
+        self.assertEqual(self.app.cqueue, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import unittest
+
+from sloppy.error import ConnectionError
+from sloppy.flow import Protocol
+from sloppy.flow import ServerFactory
+from sloppy.loopback import pair
+from sloppy.loopback import LoopbackTransport
+from sloppy.loopback import SimulatedApplication
+
+
+class Recorder(Protocol):
+    
+    def __init__(self):
+        self.chunks = []
+        self.reason = None
+    
+    def connected(self, transport):
+        self.transport = transport
+    
+    def on_data(self, data):
+        self.chunks.append(data)
+    
+    def connection_closed(self, reason):
+        self.reason = reason
+
+
+class Echo(Protocol):
+    
+    def connected(self, transport):
+        self.transport = transport
+    
+    def on_data(self, data):
+        self.transport.write(data)
+
+
+class Dropper(Recorder):
+    
+    def on_data(self, data):
+        Recorder.on_data(self, data)
+        raise ConnectionError('dropped')
+
+
+class Factory(ServerFactory):
+    
+    def protocol(self):
+        self.last = self._protocol()
+        return self.last
+
+
+class LoopbackTest(unittest.TestCase):
+    
+    def test_feed_in_chunks(self):
+        app = SimulatedApplication()
+        factory = Factory(Recorder)
+        transport = LoopbackTransport('loopback', 0, factory)
+        app.connect(transport)
+        transport.feed(b'abcdefghij', chunk=4)
+        transport.end()
+        app.start()
+        
+        self.assertEqual(factory.last.chunks, [b'abcd', b'efgh', b'ij'])
+        self.assertIs(factory.last.reason, False)
+        self.assertIsNone(transport.conn)
+    
+    def test_echo_capture(self):
+        app = SimulatedApplication()
+        server, client = pair(Factory(Echo), Factory(Recorder))
+        app.connect(server)
+        app.connect(client)
+        app.start()
+        
+        client.write(b'hello')
+        app.start()
+        
+        self.assertEqual(client.output(), b'hello')
+        self.assertEqual(server.output(), b'hello')
+        self.assertEqual(client.factory.last.chunks, [b'hello'])
+
+
+class Counting(SimulatedApplication):
+    """
+    Simulated application which counts the passes through its loop.
+    """
+    
+    passes = 0
+    
+    def wait(self, rlist, wlist, timeout):
+        self.passes += 1
+        return SimulatedApplication.wait(self, rlist, wlist, timeout)
+
+
+class BatchTest(unittest.TestCase):
+    
+    def run_chunks(self, app, protocol, count):
+        factory = Factory(protocol)
+        transport = LoopbackTransport('loopback', 0, factory)
+        app.connect(transport)
+        transport.feed(b'x' * count, chunk=1)
+        transport.end()
+        app.start()
+        return factory.last
+    
+    def test_queued_chunks_read_in_one_pass(self):
+        app = Counting()
+        protocol = self.run_chunks(app, Recorder, 1000)
+        
+        self.assertEqual(len(protocol.chunks), 1000)
+        self.assertIs(protocol.reason, False)
+        # One pass for the chunks and the end, one to find nothing left.
+        self.assertEqual(app.passes, 2)
+    
+    def test_batch_limits_a_pass(self):
+        app = Counting()
+        app.batch = 300
+        protocol = self.run_chunks(app, Recorder, 1000)
+        
+        self.assertEqual(len(protocol.chunks), 1000)
+        self.assertEqual(app.passes, 5)
+    
+    def test_close_skips_rest_of_batch(self):
+        protocol = self.run_chunks(SimulatedApplication(), Dropper, 10)
+        
+        self.assertEqual(protocol.chunks, [b'x'])
+        self.assertIsInstance(protocol.reason, ConnectionError)
+
+
+class ClockTest(unittest.TestCase):
+    
+    def test_advance_runs_due_timers(self):
+        app = SimulatedApplication()
+        calls = []
+        app.call_later(1, calls.append, 'one')
+        app.call_later(3, calls.append, 'three')
+        
+        app.advance(2)
+        self.assertEqual(calls, ['one'])
+        self.assertEqual(app.now(), 2)
+        
+        app.advance(1)
+        self.assertEqual(calls, ['one', 'three'])
+    
+    def test_cancelled_timer_does_not_run(self):
+        app = SimulatedApplication()
+        calls = []
+        timer = app.call_later(1, calls.append, 'one')
+        app.cancel(timer)
+        app.advance(5)
+        
+        self.assertEqual(calls, [])
+    
+    def test_idle_loop_skips_to_next_timer(self):
+        app = SimulatedApplication()
+        calls = []
+        app.call_later(60, lambda: calls.append(app.now()))
+        app.call_later(120, lambda: calls.append(app.now()))
+        app.start()
+        
+        self.assertEqual(calls, [60, 120])
+        self.assertFalse(app.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
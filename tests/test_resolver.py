@@ -0,0 +1,116 @@
+import socket
+import unittest
+
+from sloppy.resolver import Resolver
+
+
+def address(ip):
+    return (socket.AF_INET, socket.SOCK_STREAM, 6, (ip, 80))
+
+
+def ips(addresses):
+    return [a[3][0] for a in addresses]
+
+
+class ResolverTest(unittest.TestCase):
+    """
+    Tests for Resolver, with `getaddrinfo` and the clock replaced.
+    """
+    
+    def setUp(self):
+        self.getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = self.fake_getaddrinfo
+        self.lookups = 0
+        self.clock = 0
+        self.records = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    
+    def tearDown(self):
+        socket.getaddrinfo = self.getaddrinfo
+    
+    def fake_getaddrinfo(self, host, port, family=0, socktype=0, *args):
+        self.lookups += 1
+        # Duplicates, as getaddrinfo returns one entry per socket type.
+        return [(socket.AF_INET, socktype, 6, '', (ip, port))
+            for ip in self.records + self.records[:1]]
+    
+    def resolver(self, **kwargs):
+        dns = Resolver(**kwargs)
+        dns.now = lambda: self.clock
+        return dns
+    
+    def test_lookup(self):
+        dns = self.resolver()
+        
+        self.assertEqual(dns.lookup('host', 80), [address('10.0.0.1'),
+            address('10.0.0.2'), address('10.0.0.3')])
+        self.assertEqual(self.lookups, 1)
+    
+    def test_round_robin(self):
+        dns = self.resolver(strategy=Resolver.ROUNDROBIN)
+        
+        self.assertEqual(ips(dns.addresses('host', 80)),
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+        self.assertEqual(ips(dns.addresses('host', 80)),
+            ['10.0.0.2', '10.0.0.3', '10.0.0.1'])
+        self.assertEqual(ips(dns.addresses('host', 80)),
+            ['10.0.0.3', '10.0.0.1', '10.0.0.2'])
+    
+    def test_failover(self):
+        dns = self.resolver(strategy=Resolver.FAILOVER)
+        
+        self.assertEqual(ips(dns.addresses('host', 80))[0], '10.0.0.1')
+        self.assertEqual(ips(dns.addresses('host', 80))[0], '10.0.0.1')
+        
+        dns.failed('host', 80, address('10.0.0.1'))
+        self.assertEqual(ips(dns.addresses('host', 80)),
+            ['10.0.0.2', '10.0.0.3', '10.0.0.1'])
+    
+    def test_ttl(self):
+        dns = self.resolver(ttl=10)
+        dns.addresses('host', 80)
+        self.clock = 9
+        dns.addresses('host', 80)
+        self.assertEqual(self.lookups, 1)
+        
+        self.clock = 10
+        self.records = ['10.0.0.4']
+        self.assertEqual(ips(dns.addresses('host', 80)), ['10.0.0.4'])
+        self.assertEqual(self.lookups, 2)
+    
+    def test_expire(self):
+        dns = self.resolver()
+        dns.addresses('host', 80)
+        dns.addresses('other', 80)
+        dns.expire('host')
+        dns.addresses('host', 80)
+        dns.addresses('other', 80)
+        self.assertEqual(self.lookups, 3)
+        
+        dns.expire()
+        dns.addresses('other', 80)
+        self.assertEqual(self.lookups, 4)
+    
+    def test_lookup_error(self):
+        def fail(*args):
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        
+        socket.getaddrinfo = fail
+        self.assertRaises(socket.gaierror, self.resolver().lookup, 'host', 80)
+    
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, Resolver, strategy='random')
+
+
+class SystemResolverTest(unittest.TestCase):
+    
+    def test_getaddrinfo(self):
+        dns = Resolver()
+        addresses = dns.lookup('127.0.0.1', 80)
+        
+        self.assertEqual(addresses[0][0], socket.AF_INET)
+        self.assertEqual(addresses[0][3], ('127.0.0.1', 80))
+        self.assertIs(dns.lookup('127.0.0.1', 80), addresses)
+
+
+if __name__ == '__main__':
+    unittest.main()
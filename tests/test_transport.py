@@ -0,0 +1,166 @@
+import socket
+import select
+import unittest
+
+from sloppy.flow import Protocol
+from sloppy.flow import ServerFactory
+from sloppy.flow import ConnectionFactory
+from sloppy.transport import Transport
+from sloppy.transport import TCPClient
+from sloppy.loopback import LoopbackTransport
+from sloppy.loopback import SimulatedApplication
+
+
+class Headers(Protocol):
+    
+    def connected(self, transport):
+        self.transport = transport
+    
+    def on_data(self, data):
+        self.transport.write(b'head ')
+        self.transport.write(data)
+        self.transport.write(b' tail')
+
+
+class Slow(Transport):
+    """
+    Transport whose connection only takes `room` bytes at a time.
+    """
+    
+    def init(self, addr, port, factory=None):
+        self.conn = self
+        self.room = 0
+        self.sent = []
+    
+    def send(self, data):
+        data = data[:self.room]
+        self.room -= len(data)
+        self.sent.append(data)
+        return len(data)
+
+
+class WriteTest(unittest.TestCase):
+    
+    def test_coalesced_writes_flush_once(self):
+        app = SimulatedApplication()
+        factory = ServerFactory(Headers)
+        factory.coalesce = True
+        transport = LoopbackTransport('loopback', 0, factory)
+        app.connect(transport)
+        transport.feed(b'body')
+        app.start()
+        
+        self.assertEqual(transport.written, [b'head body tail'])
+    
+    def test_cork_holds_writes(self):
+        app = SimulatedApplication()
+        transport = LoopbackTransport('loopback', 0, ServerFactory(Protocol))
+        app.connect(transport)
+        app.start()
+        
+        transport.cork()
+        transport.write(b'one')
+        transport.write(b'two')
+        self.assertEqual(transport.written, [])
+        self.assertFalse(transport.pending())
+        self.assertEqual(transport.buffered(), 6)
+        
+        self.assertEqual(transport.uncork(), 6)
+        self.assertEqual(transport.written, [b'onetwo'])
+    
+    def test_short_send_blocks(self):
+        transport = Slow('slow', 0)
+        transport.room = 4
+        
+        self.assertEqual(transport.write(b'0123456789'), 4)
+        self.assertTrue(transport.blocked)
+        self.assertEqual(transport.buffered(), 6)
+        
+        # Later writes queue up behind what is left.
+        self.assertEqual(transport.write(b'abc'), 3)
+        self.assertEqual(transport.buffered(), 9)
+        
+        transport.room = 100
+        self.assertEqual(transport.flush(), 9)
+        self.assertFalse(transport.blocked)
+        self.assertEqual(b''.join(transport.sent), b'0123456789abc')
+    
+    def test_flush_sends_batches(self):
+        transport = Slow('slow', 0)
+        transport.room = 100
+        transport.batch_size = 8
+        transport.cork()
+        
+        for data in (b'aaaa', b'bbbb', b'cccc'):
+            transport.write(data)
+        
+        self.assertEqual(transport.uncork(), 12)
+        self.assertEqual(transport.sent, [b'aaaabbbb', b'cccc'])
+    
+    def test_backlog_is_not_copied(self):
+        transport = Slow('slow', 0)
+        data = b'x' * 100000
+        transport.write(data)
+        
+        for i in range(10):
+            transport.room = 1000
+            transport.flush()
+            # The rest of the chunk is kept as a view on the original.
+            self.assertIs(transport._wbuffer[0].obj, data)
+        
+        transport.room = len(data)
+        transport.flush()
+        self.assertEqual(b''.join(transport.sent), data)
+        self.assertEqual(transport.buffered(), 0)
+
+
+class CorkFactory(ConnectionFactory):
+    
+    cork = True
+
+
+class KernelCorkTest(unittest.TestCase):
+    
+    def setUp(self):
+        if not hasattr(socket, 'TCP_CORK'):
+            self.skipTest('TCP_CORK is not supported')
+        
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.transport = TCPClient('127.0.0.1', listener.getsockname()[1],
+            CorkFactory())
+        self.assertTrue(self.transport.connect())
+        
+        if self.transport.connecting:
+            select.select([], [self.transport.conn], [], 2)
+            self.assertTrue(self.transport.check_connect())
+        
+        self.peer = listener.accept()[0]
+        listener.close()
+    
+    def tearDown(self):
+        if hasattr(self, 'peer'):
+            self.transport.close()
+            self.peer.close()
+    
+    def corked(self):
+        return self.transport.conn.getsockopt(socket.IPPROTO_TCP,
+            socket.TCP_CORK)
+    
+    def test_cork_sets_tcp_cork(self):
+        self.transport.cork()
+        self.assertEqual(self.corked(), 1)
+        
+        # The kernel holds the data, so the transport doesn't buffer it.
+        self.assertEqual(self.transport.write(b'hello'), 5)
+        self.assertEqual(self.transport.buffered(), 0)
+        
+        self.transport.uncork()
+        self.assertEqual(self.corked(), 0)
+        self.peer.settimeout(1)
+        self.assertEqual(self.peer.recv(10), b'hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import socket
+import unittest
+
+from sloppy.loopback import LoopbackTransport
+from sloppy.loopback import SimulatedApplication
+from sloppy.protocol.ws import frame
+from sloppy.protocol.ws.flow import WSHandshakeError
+from sloppy.protocol.ws.flow import WebSocketClientFactory
+from sloppy.protocol.ws.flow import WebSocketClientProtocol
+from sloppy.protocol.ws.transport import WebSocketClient
+
+
+class FrameTest(unittest.TestCase):
+    
+    def test_accept_key(self):
+        # Example from RFC 6455, section 1.3.
+        self.assertEqual(frame.accept_key(b'dGhlIHNhbXBsZSBub25jZQ=='),
+            b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+    
+    def test_mask_is_reversible(self):
+        key = b'\x01\x02\x03\x04'
+        data = b'some payload which is not a multiple of four'
+        masked = frame.apply_mask(data, key)
+        
+        self.assertNotEqual(masked, data)
+        self.assertEqual(masked[:4], b'\x72\x6d\x6e\x61')
+        self.assertEqual(frame.apply_mask(masked, key), data)
+    
+    def test_mask_keeps_leading_zeros(self):
+        key = b'\xff\xff\xff\xff'
+        self.assertEqual(frame.apply_mask(b'\xff\x00', key), b'\x00\xff')
+    
+    def test_round_trip(self):
+        for size in (0, 5, 125, 126, 65535, 65536):
+            payload = b'x' * size
+            for mask in (False, True):
+                data = frame.encode(payload, frame.OP_BINARY, mask)
+                fin, opcode, decoded, end = frame.decode(data)
+                
+                self.assertTrue(fin)
+                self.assertEqual(opcode, frame.OP_BINARY)
+                self.assertEqual(decoded, payload)
+                self.assertEqual(end, len(data))
+    
+    def test_partial_frame(self):
+        data = frame.encode(b'hello', mask=True)
+        
+        for i in range(len(data)):
+            self.assertIsNone(frame.decode(data[:i]))
+    
+    def test_decode_at_offset(self):
+        data = frame.encode(b'one') + frame.encode(b'two', fin=False)
+        first = frame.decode(data)
+        second = frame.decode(data, first[3])
+        
+        self.assertEqual(first[2], b'one')
+        self.assertEqual(second, (False, frame.OP_TEXT, b'two', len(data)))
+
+
+class Client(WebSocketClientProtocol):
+    
+    def __init__(self, factory=None):
+        WebSocketClientProtocol.__init__(self, factory)
+        self.messages = []
+    
+    def on_message(self, message, binary=False):
+        self.messages.append((message, binary))
+
+
+class Transport(LoopbackTransport):
+    """
+    Loopback transport which frames what is written, like WebSocketClient.
+    """
+    
+    handshaked = True
+    
+    def write(self, data, opcode=frame.OP_TEXT):
+        return LoopbackTransport.write(self, frame.encode(data, opcode))
+    
+    def pong(self, data=b''):
+        return self.write(data, frame.OP_PONG)
+
+
+class Factory(WebSocketClientFactory):
+    
+    def protocol(self):
+        self.last = self._protocol(self)
+        return self.last
+
+
+class ClientProtocolTest(unittest.TestCase):
+    
+    def run_frames(self, data, chunk):
+        app = SimulatedApplication()
+        factory = Factory(Client)
+        transport = Transport('loopback', 0, factory)
+        app.connect(transport)
+        transport.feed(data, chunk=chunk)
+        app.start()
+        return factory.last, transport
+    
+    def test_messages_split_across_chunks(self):
+        data = (frame.encode(b'hello') + frame.encode(b'world', frame.OP_BINARY)
+            + frame.encode(b'x' * 300))
+        
+        for chunk in (1, 3, 64, None):
+            protocol, transport = self.run_frames(data, chunk)
+            self.assertEqual(protocol.messages, [
+                (b'hello', False), (b'world', True), (b'x' * 300, False)])
+    
+    def test_fragmented_message(self):
+        data = (frame.encode(b'hel', fin=False)
+            + frame.encode(b'lo', frame.OP_CONTINUATION))
+        protocol, transport = self.run_frames(data, 2)
+        
+        self.assertEqual(protocol.messages, [(b'hello', False)])
+    
+    def test_ping_gets_pong(self):
+        protocol, transport = self.run_frames(frame.encode(b'hi', frame.OP_PING), None)
+        
+        self.assertEqual(transport.output(), frame.encode(b'hi', frame.OP_PONG))
+
+
+class HandshakeTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.conn, self.peer = socket.socketpair()
+        self.peer.settimeout(2)
+        self.transport = WebSocketClient('server', 8080, Factory(Client))
+        self.transport.conn = self.conn
+        self.transport.mask = True
+        self.transport.handshake()
+        self.protocol = Client()
+        self.protocol.connected(self.transport)
+    
+    def tearDown(self):
+        self.conn.close()
+        self.peer.close()
+    
+    def response(self, accept):
+        return ('HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {0}\r\n\r\n'.format(accept)).encode()
+    
+    def request_key(self):
+        request = self.peer.recv(4096).decode()
+        self.assertTrue(request.startswith('GET / HTTP/1.1\r\n'))
+        
+        for line in request.split('\r\n'):
+            if line.startswith('Sec-WebSocket-Key:'):
+                return line.split(':', 1)[1].strip().encode()
+    
+    def test_valid_response(self):
+        accept = frame.accept_key(self.request_key()).decode()
+        # The first message can arrive in the same chunk as the response.
+        self.protocol.on_data(self.response(accept) + frame.encode(b'hello'))
+        
+        self.assertTrue(self.transport.handshaked)
+        self.assertEqual(self.protocol.messages, [(b'hello', False)])
+    
+    def test_bad_accept_key(self):
+        self.request_key()
+        accept = frame.accept_key(b'dGhlIHNhbXBsZSBub25jZQ==').decode()
+        
+        self.assertRaises(WSHandshakeError, self.protocol.on_data,
+            self.response(accept))
+        self.assertFalse(self.transport.handshaked)
+        self.assertEqual(self.protocol.messages, [])
+    
+    def test_refused_upgrade(self):
+        self.request_key()
+        
+        self.assertRaises(WSHandshakeError, self.protocol.on_data,
+            b'HTTP/1.1 400 Bad Request\r\n\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()